@@ -10,8 +10,7 @@ Programmer: Erel Segal-Halevi.
 Since: 2021-12
 """
 
-from typing import *
-from dataclasses import dataclass
+from typing import Any, Callable, List, NamedTuple, Set
 from dynprog import logger
 
 Input = List[int]
@@ -22,6 +21,14 @@ Solution = Any
 from abc import ABC, abstractmethod
 
 
+class StateRecord(NamedTuple):
+    # A state, with a link to the record from which it was reached, used for constructing the optimal solution.
+    # A named tuple has no per-instance __dict__, which matters since a record is created for every state.
+    state: State
+    prev: Any  # StateRecord
+    transition_index: int  # the index of the transition function used to go from prev to state.
+
+
 class SequentialDynamicProgram(ABC):
 
     ### The following abstract methods define the dynamic program.
@@ -40,16 +47,32 @@ class SequentialDynamicProgram(ABC):
         return lambda state: 0
 
     # Return a set of functions; each function maps a pair (state,input) to a boolean value which is "true" iff the new state should be added [The set H from the paper].
-    # By default, there is no filtering - every state is legal.
+    # A function may be None, which means that there is no filtering for the corresponding transition - it is skipped without a function call.
+    # By default, there is no filtering - every state is legal (this is denoted by returning None).
     def filter_functions(self) -> List[Callable[[State, Input], bool]]:
-        return [
-            (lambda state, input: True) for _ in self.transition_functions()
-        ]
+        return None
+
+    # Return a function that maps a pair (states, input_index) to the subset of states that should be kept,
+    #    where the states were all reached after processing the inputs up to and including input #input_index.
+    # It can be used to prune states that are dominated by other states, and thus cannot lead to a better final value.
+    # By default, there is no pruning - every state is kept.
+    def pruning_function(self) -> Callable[[Set[State], int], Set[State]]:
+        return None
+
+    # Return a function that maps a pair (state,input) to the tuple of new states of all transition functions, in the same order.
+    # It must be equivalent to the transition functions; it replaces a function call per transition function and state by a single call per state.
+    # It is used only when there are no filter functions.
+    # By default, there is no such function - the transition functions are called one by one.
+    def batch_transition_function(self) -> Callable[[State, Input], tuple]:
+        return None
 
     @abstractmethod
     def initial_solution(self) -> Solution:
         return []
 
+    # Return a list of functions, one for each transition function; each function maps a pair (solution,input) to a new solution.
+    # They are applied only once, along the path to the best final state (the DP itself keeps only a link to the previous state),
+    # so they may modify the given solution in place and return it.
     @abstractmethod
     def construction_functions(
         self,
@@ -66,8 +89,14 @@ class SequentialDynamicProgram(ABC):
         """
         current_states = set(self.initial_states())
         transition_functions = self.transition_functions()
-        filter_functions = self.filter_functions()
+        filter_functions = self.filter_functions() or [
+            None for _ in transition_functions
+        ]
         value_function = self.value_function()
+        pruning_function = self.pruning_function()
+        batch_transition_function = (
+            None if any(filter_functions) else self.batch_transition_function()
+        )
         logger.info(
             "%d initial states, %d transition functions, %d filter functions.",
             len(current_states),
@@ -75,13 +104,25 @@ class SequentialDynamicProgram(ABC):
             len(filter_functions),
         )
         num_of_processed_states = len(current_states)
+        transitions_and_filters = tuple(
+            zip(transition_functions, filter_functions)
+        )  # built once, rather than once per input.
         for input_index, input in enumerate(inputs):
-            next_states = {
-                f(state, input)
-                for (f, h) in zip(transition_functions, filter_functions)
-                for state in current_states
-                if h(state, input)
-            }
+            if batch_transition_function is not None:
+                next_states = {
+                    next_state
+                    for state in current_states
+                    for next_state in batch_transition_function(state, input)
+                }
+            else:
+                next_states = {
+                    f(state, input)
+                    for (f, h) in transitions_and_filters
+                    for state in current_states
+                    if h is None or h(state, input)
+                }
+            if pruning_function is not None:
+                next_states = pruning_function(next_states, input_index)
             logger.info(
                 "  Processed input %d (%s) and added %d states.",
                 input_index,
@@ -93,9 +134,7 @@ class SequentialDynamicProgram(ABC):
         logger.info("Processed %d states.", num_of_processed_states)
         if len(current_states) == 0:
             raise ValueError("No final states!")
-        best_final_state = max(
-            current_states, key=lambda state: value_function(state)
-        )
+        best_final_state = max(current_states, key=value_function)
         best_final_state_value = value_function(best_final_state)
         logger.info(
             "Best final state: %s, value: %s",
@@ -112,25 +151,19 @@ class SequentialDynamicProgram(ABC):
         inputs = list(inputs)
         # allow to iterate twice. See https://stackoverflow.com/q/70381559/827927
 
-        @dataclass
-        class StateRecord:
-            state: State
-            prev: Any  # StateRecord
-            transition_index: int  # the index of the transition function used to go from prev to state.
-
-            def __hash__(self):
-                return hash(self.state)
-
-            def __eq__(self, other):
-                return self.state == other.state
-
         current_state_records = {
-            StateRecord(state, None, None) for state in self.initial_states()
-        }  # Add a link to the 'previous state', which is initially None.
+            state: StateRecord(state, None, None) for state in self.initial_states()
+        }  # Map each state to its record, with a link to the 'previous state', which is initially None.
         transition_functions = self.transition_functions()
-        filter_functions = self.filter_functions()
+        filter_functions = self.filter_functions() or [
+            None for _ in transition_functions
+        ]
         value_function = self.value_function()
         construction_functions = self.construction_functions()
+        pruning_function = self.pruning_function()
+        batch_transition_function = (
+            None if any(filter_functions) else self.batch_transition_function()
+        )
         logger.info(
             "%d initial states, %d transition functions, %d filter functions, %d construction functions.",
             len(current_state_records),
@@ -139,15 +172,38 @@ class SequentialDynamicProgram(ABC):
             len(construction_functions),
         )
         num_of_processed_states = len(current_state_records)
+        indexed_transitions_and_filters = tuple(
+            enumerate(zip(transition_functions, filter_functions))
+        )  # built once, rather than once per input.
         for input_index, input in enumerate(inputs):
-            next_state_records = {
-                StateRecord(f(record.state, input), record, transition_index)
-                for (transition_index, (f, h)) in enumerate(
-                    zip(transition_functions, filter_functions)
-                )
-                for record in current_state_records
-                if h(record.state, input)
-            }
+            # The new states are deduplicated as they are generated, by keying the records on the states themselves.
+            # When several records lead to the same state, the first one is kept.
+            next_state_records = {}
+            if batch_transition_function is not None:
+                for record in current_state_records.values():
+                    for (transition_index, next_state) in enumerate(
+                        batch_transition_function(record.state, input)
+                    ):
+                        if next_state not in next_state_records:
+                            next_state_records[next_state] = StateRecord(
+                                next_state, record, transition_index
+                            )
+            else:
+                for (transition_index, (f, h)) in indexed_transitions_and_filters:
+                    for record in current_state_records.values():
+                        if h is None or h(record.state, input):
+                            next_state = f(record.state, input)
+                            if next_state not in next_state_records:
+                                next_state_records[next_state] = StateRecord(
+                                    next_state, record, transition_index
+                                )
+            if pruning_function is not None:
+                kept_states = pruning_function(next_state_records.keys(), input_index)
+                next_state_records = {
+                    state: record
+                    for state, record in next_state_records.items()
+                    if state in kept_states
+                }
             logger.info(
                 "  Processed input %d (%s) and added %d states.",
                 input_index,
@@ -162,7 +218,7 @@ class SequentialDynamicProgram(ABC):
             raise ValueError("No final states!")
 
         best_final_record = max(
-            current_state_records,
+            current_state_records.values(),
             key=lambda record: value_function(record.state),
         )
         best_final_state = best_final_record.state
@@ -172,8 +228,9 @@ class SequentialDynamicProgram(ABC):
         path = []
         record = best_final_record
         while record.prev is not None:
-            path.insert(0, record.transition_index)
+            path.append(record.transition_index)
             record = record.prev
+        path.reverse()  # appending and reversing once is linear, while inserting at the front is quadratic.
         logger.info("Path to best solution: %s", path)
 
         # construct solution
@@ -233,7 +290,7 @@ if __name__ == "__main__":
             return [
                 lambda state, input: state + input
                 <= capacity,  # adding the input
-                lambda _, __: True,  # not adding the input
+                None,  # not adding the input - no filter
             ]
 
     inputs = [100, 200, 300, 400, 700, 1100, 1600, 2200, 2900, 3700]
@@ -6,8 +6,9 @@ Programmer: Erel Segal-Halevi.
 Since: 2021-11.
 """
 
-from typing import *
+from typing import Any, Callable, Generator, Tuple
 from numbers import Number
+from collections import deque
 
 State = Any
 Value = Number
@@ -17,6 +18,8 @@ StateValueData = Tuple[State,Value,Any]
 import logging
 logger = logging.getLogger(__name__)
 
+_NOT_FOUND = object()   # a sentinel for dictionary lookups, since None is a legal value.
+
 
 def max_value(
     initial_states: Generator[StateValue, None, None], 
@@ -37,31 +40,34 @@ def max_value(
     * final_states:   a generator function, that generates all final states.
     * is_final_state: returns True iff the given state is final. 
     """
-    open_states = []
+    if final_states is None and is_final_state is None:
+        raise ValueError("Either final_states or is_final_state must be given")
+    open_states = deque()
     map_state_to_value = dict()
+    reached_final_states = []   # used only with is_final_state, so that the non-final states need not be scanned again at the end.
     for state,value in initial_states():
         open_states.append(state)
         map_state_to_value[state]=value
     num_of_processed_states = 0
     while len(open_states)>0:
-        current_state:State = open_states.pop(0)
+        current_state:State = open_states.popleft()
         current_value = map_state_to_value[current_state]
         logger.info("Processing state %s with value %s", current_state,current_value)
         num_of_processed_states += 1
+        if final_states is None and is_final_state(current_state):
+            reached_final_states.append(current_state)
         for (next_state,next_value) in neighbors(current_state, current_value):
-            if next_state in map_state_to_value: 
-                if next_value is not None:
-                    map_state_to_value[next_state] = max(map_state_to_value[next_state], next_value)
-            else:
+            old_value = map_state_to_value.get(next_state, _NOT_FOUND)  # a single hash lookup for both membership and value.
+            if old_value is _NOT_FOUND:
                 map_state_to_value[next_state] = next_value
                 open_states.append(next_state)
+            elif next_value is not None:
+                map_state_to_value[next_state] = max(old_value, next_value)
     logger.info("Processed %d states", num_of_processed_states)
     if final_states is not None:
-        return max([map_state_to_value[state] for state in final_states()])
-    elif is_final_state is not None:
-        return max([map_state_to_value[state] for state in map_state_to_value.keys() if is_final_state(state)])
+        return max(map_state_to_value[state] for state in final_states())
     else:
-        raise ValueError("Either final_states or is_final_state must be given")
+        return max(map_state_to_value[state] for state in reached_final_states)
 
 
 
@@ -86,40 +92,35 @@ def max_value_solution(
     * is_final_state: returns True iff the given state is final. 
 
     """
-    open_states = []
-    map_state_to_value = dict()
-    map_state_to_data = dict()
+    if final_states is None and is_final_state is None:
+        raise ValueError("Either final_states or is_final_state must be given")
+    open_states = deque()
+    reached_final_states = []   # used only with is_final_state, so that the non-final states need not be scanned again at the end.
+    map_state_to_value_data = dict()   # maps each state to a pair (value,data), so that each state is hashed once per lookup.
     for state,value,data in initial_states():
         open_states.append(state)
-        map_state_to_value[state]=value
-        map_state_to_data[state]=data
+        map_state_to_value_data[state]=(value,data)
     num_of_processed_states = 0
     while len(open_states)>0:
-        current_state:State = open_states.pop(0)
-        current_value = map_state_to_value[current_state]
-        current_data  = map_state_to_data[current_state]
+        current_state:State = open_states.popleft()
+        (current_value,current_data) = map_state_to_value_data[current_state]
         num_of_processed_states += 1
         logger.info("Processing state %s with value %s and data %s", current_state,current_value,current_data)
+        if final_states is None and is_final_state(current_state):
+            reached_final_states.append(current_state)
         for (next_state,next_value,next_data) in neighbors(current_state, current_value, current_data):
-            if next_state in map_state_to_value: 
-                if next_value is not None and next_value > map_state_to_value[next_state]:
-                    logger.info("Improving state %s to value %s and data %s", next_state,next_value,next_data)
-                    map_state_to_value[next_state] = next_value
-                    map_state_to_data[next_state]  = next_data
-                pass
-            else:
-                map_state_to_value[next_state] = next_value
-                map_state_to_data[next_state] = next_data
+            old_value_data = map_state_to_value_data.get(next_state)
+            if old_value_data is None:
+                map_state_to_value_data[next_state] = (next_value,next_data)
                 open_states.append(next_state)
+            elif next_value is not None and next_value > old_value_data[0]:
+                logger.info("Improving state %s to value %s and data %s", next_state,next_value,next_data)
+                map_state_to_value_data[next_state] = (next_value,next_data)
     logger.info("Processed %d states", num_of_processed_states)
-    if final_states is not None:
-        best_final_state = max(list(final_states()), key=lambda state:map_state_to_value[state])
-    elif is_final_state is not None:
-        best_final_state = max([state for state in map_state_to_value.keys() if is_final_state(state)], key=lambda state:map_state_to_value[state])
-    else:
-        raise ValueError("Either final_states or is_final_state must be given")
-    best_final_state_value = map_state_to_value[best_final_state]
-    best_final_state_data = map_state_to_data[best_final_state]
+    best_final_state = max(
+        final_states() if final_states is not None else reached_final_states,
+        key=lambda state:map_state_to_value_data[state][0])
+    (best_final_state_value, best_final_state_data) = map_state_to_value_data[best_final_state]
     return (best_final_state, best_final_state_value, best_final_state_data, num_of_processed_states)
 
 
@@ -10,6 +10,7 @@ The input is a valuation-matrix v, where v[i][j] is the value of agent i to item
 
 The states are of the form  (v1, v2, ..., vn) where n is the number of agents.
 The "vi" are the value of bundle i to agent i.
+When all values are non-negative integers, each state is packed into a single int (see common.pack).
 
 Programmer: Erel Segal-Halevi
 Since: 2021-12
@@ -19,9 +20,10 @@ Since: 2021-12
 import dynprog
 from dynprog.sequential import SequentialDynamicProgram
 
-from typing import *
-
-from common import add_input_to_bin, add_input_to_agent_value
+from common import (
+    add_input_to_bin, items_as_value_vectors, compile_add_input_to_agent_value, pareto_optimal_states,
+    is_non_negative_integer_matrix, packed_field_width, compile_packed_min, packed_pareto_optimal_states,
+)
 
 
 def egalitarian_value(valuation_matrix):
@@ -37,10 +39,13 @@ def egalitarian_value(valuation_matrix):
     77
     >>> egalitarian_value([[37,93,0,49,52,59,97,24,90],[62,21,31,27,67,29,24,65,47],[4,57,27,36,65,27,50,46,92]])
     187
+    >>> egalitarian_value([[0.4,0.6],[0.6,0.4]])
+    0.6
+    >>> egalitarian_value([[-2,-1,5],[-4,8,1]])
+    4
     """
-    num_of_agents   = len(valuation_matrix)
-    items = _items_as_value_vectors(valuation_matrix)
-    return EgalitarianDP(num_of_agents).max_value(items)
+    dp = EgalitarianDP(valuation_matrix)
+    return dp.max_value(dp.items_as_shifted_value_vectors(valuation_matrix))
 
 
 
@@ -53,25 +58,15 @@ def egalitarian_allocation(valuation_matrix):
     >>> egalitarian_allocation([[11,22,33,44],[44,33,22,11]])
     (77, [[2, 3], [0, 1]])
     >>> egalitarian_allocation([[11,22,33,44,55],[44,33,22,11,55],[55,66,77,88,99]])
-    (77, [[2, 3], [0, 1], [4]])
+    (77, [[3, 4], [0, 1], [2]])
     >>> egalitarian_allocation([[37,93,0,49,52,59,97,24,90],[62,21,31,27,67,29,24,65,47],[4,57,27,36,65,27,50,46,92]])
     (187, [[1, 6], [0, 2, 5, 7], [3, 4, 8]])
     """
-    num_of_agents   = len(valuation_matrix)
-    items = _items_as_value_vectors(valuation_matrix)
-    (best_state,best_value,best_solution,num_of_states) = EgalitarianDP(num_of_agents).max_value_solution(items)
+    dp = EgalitarianDP(valuation_matrix)
+    (best_state,best_value,best_solution,num_of_states) = dp.max_value_solution(dp.items_as_shifted_value_vectors(valuation_matrix))
     return (best_value,best_solution)
 
 
-def _items_as_value_vectors(valuation_matrix):
-    num_of_agents   = len(valuation_matrix)
-    num_of_items    = len(valuation_matrix[0])
-    return [  # Each item is represented by a vector of values - a value for each agent. The last value is the item index.
-        [valuation_matrix[agent_index][item_index] for agent_index in range(num_of_agents)] + [item_index]
-        for item_index in range(num_of_items)
-    ]
-
-
 
 
 #### Dynamic program definition:
@@ -80,12 +75,43 @@ class EgalitarianDP(SequentialDynamicProgram):
 
     # The states are of the form  (v1, v2, ..., vn) where n is the number of agents.
     # The "vi" are the value of bundle i to agent i.
-
-    def __init__(self, num_of_agents:int):
-        self.num_of_agents = num_of_agents
+    # When all values are non-negative integers, each state is packed into a single int,
+    #    so that hashing a state, and giving an item to an agent, take a single int operation.
+    # Otherwise (negative or fractional values), the states are tuples.
+    # The inputs are items returned by items_as_shifted_value_vectors: in packed states, the value of agent i is already shifted to field i.
+
+    def __init__(self, valuation_matrix):
+        self.num_of_agents = len(valuation_matrix)
+        self.packed = is_non_negative_integer_matrix(valuation_matrix)
+        if self.packed:
+            self.field_width = packed_field_width(max(map(sum, valuation_matrix)))
+
+    def items_as_shifted_value_vectors(self, valuation_matrix):
+        """
+        Converts the valuation matrix into a list of value-vectors, like common.items_as_value_vectors,
+        where the value of each agent is shifted to the agent's field in the packed state.
+        The shift is done once per item and agent, rather than once per state.
+        The last element (the item index) is not shifted.
+        If the states are not packed, the items are returned as common.items_as_value_vectors.
+
+        >>> EgalitarianDP([[1,2],[3,4]]).items_as_shifted_value_vectors([[1,2],[3,4]])
+        [(1, 48, 0), (2, 64, 1)]
+        >>> EgalitarianDP([[1,2],[3,-4]]).items_as_shifted_value_vectors([[1,2],[3,-4]])
+        [(1, 3, 0), (2, -4, 1)]
+        """
+        if not self.packed:
+            return items_as_value_vectors(valuation_matrix)
+        shifted_valuation_matrix = [
+            [value << (agent_index*self.field_width) for value in agent_values]
+            for agent_index, agent_values in enumerate(valuation_matrix)
+        ]
+        return [
+            item_values + (item_index,)
+            for item_index, item_values in enumerate(zip(*shifted_valuation_matrix))
+        ]
 
     def initial_states(self):
-        zero_values = self.num_of_agents*(0,)
+        zero_values = 0 if self.packed else self.num_of_agents*(0,)   # 0 = pack(self.num_of_agents*(0,), self.field_width)
         return {zero_values}
 
     def initial_solution(self):
@@ -93,8 +119,13 @@ class EgalitarianDP(SequentialDynamicProgram):
         return empty_bundles
    
     def transition_functions(self):
+        if not self.packed:
+            return [
+                compile_add_input_to_agent_value(self.num_of_agents, agent_index)
+                for agent_index in range(self.num_of_agents)
+            ]
         return [
-            lambda state, input, agent_index=agent_index: add_input_to_agent_value(state, agent_index, input)
+            lambda state, input, agent_index=agent_index: state + input[agent_index]
             for agent_index in range(self.num_of_agents)
         ]
 
@@ -105,8 +136,15 @@ class EgalitarianDP(SequentialDynamicProgram):
         ]
 
     def value_function(self):
-        return lambda state: min(state)
+        if not self.packed:
+            return min
+        return compile_packed_min(self.num_of_agents, self.field_width)
 
+    def pruning_function(self):
+        # If a state is at least as large as another state in every coordinate, then the other state cannot lead to a better min.
+        if not self.packed:
+            return lambda states, input_index: pareto_optimal_states(states)
+        return lambda states, input_index: packed_pareto_optimal_states(states, self.num_of_agents, self.field_width)
 
 
 
@@ -122,8 +160,8 @@ if __name__=="__main__":
 
     dynprog.sequential.logger.setLevel(logging.INFO)
     import numpy as np
-    valuation_matrix = np.random.randint(0,9, [3,10]) # 3 agents, 10 items
+    valuation_matrix = np.random.randint(0,9, [3,10]).tolist() # 3 agents, 10 items. Python ints do not overflow when packed.
     print("valuation_matrix:\n",valuation_matrix)
     print(egalitarian_value(valuation_matrix))
     print(egalitarian_allocation(valuation_matrix))
-    # Should have about 30k-40k states.
+    # Should have a few hundred states (about 30k-40k states without pruning).
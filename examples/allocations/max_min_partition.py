@@ -6,6 +6,9 @@ max-min number partitioning problem.
 
 The states are of the form  (v1, v2, ..., vn) where n is the number of bins.
 The "vi" is the current sum in bin i.
+Since the bins are interchangeable, the sums in each state are kept sorted,
+so that all permutations of the same sums are merged into a single state.
+Each state is packed into a single int (see common.py), so it is hashed and updated with a few int operations.
 
 Programmer: Erel Segal-Halevi
 Since: 2021-12
@@ -14,9 +17,11 @@ Since: 2021-12
 import dynprog
 from dynprog.sequential import SequentialDynamicProgram
 
-from typing import *
+from typing import List
+from itertools import accumulate
+from heapq import heappush, heappop
 
-from common import add_input_to_bin_sum, add_input_to_bin
+from common import compile_add_input_to_sorted_packed_bin_sum, compile_add_input_to_sorted_packed_bin_sums, add_input_to_bin, packed_field_width
 
 
 def max_min_value(items:List[int], num_of_bins:int):
@@ -30,7 +35,44 @@ def max_min_value(items:List[int], num_of_bins:int):
     >>> max_min_value([11,22,33,44,55,66,77,88,99], 3)
     165
     """
-    return PartitionDP(num_of_bins).max_value(items)
+    return PartitionDP(num_of_bins, items).max_value(items)
+
+def max_min_value_best_first(items:List[int], num_of_bins:int):
+    """
+    Returns the max-min value, like max_min_value, using a best-first (branch-and-bound) search over the states of PartitionDP.
+    The states are expanded in decreasing order of an upper bound on their final value:
+    the smaller of the bound in PartitionDP.pruning_function and the average bin sum.
+    The bound never increases along a path, so the first final state to be expanded is optimal,
+    and states whose bound is below the optimal value are never expanded.
+
+    >>> max_min_value_best_first([1,2,3,4], 2)
+    5
+    >>> max_min_value_best_first([1,2,3,4,5], 2)
+    7
+    >>> max_min_value_best_first([11,22,33,44,55,66,77,88,99], 3)
+    165
+    >>> max_min_value_best_first([], 3)
+    0
+    """
+    dp = PartitionDP(num_of_bins, items)
+    batch_transition_function = dp.batch_transition_function()
+    value_function = dp.value_function()
+    num_of_items = len(items)
+    average_bin_sum = sum(items) // num_of_bins   # the smallest bin sum is at most the average.
+    open_states = [(-average_bin_sum, 0, 0)]   # (-upper bound, -number of processed items, state); deeper states are preferred on ties.
+    expanded_states = set()
+    while True:
+        (minus_bound, minus_item_index, state) = heappop(open_states)
+        item_index = -minus_item_index
+        if item_index == num_of_items:
+            return -minus_bound
+        if (item_index, state) in expanded_states:
+            continue
+        expanded_states.add((item_index, state))
+        remaining_sum = dp.remaining_sums[item_index]
+        for next_state in set(batch_transition_function(state, items[item_index])):
+            bound = min(value_function(next_state) + remaining_sum, average_bin_sum)
+            heappush(open_states, (-bound, -(item_index+1), next_state))
 
 def max_min_partition(items:list, num_of_bins:int):
     """
@@ -39,11 +81,11 @@ def max_min_partition(items:list, num_of_bins:int):
     >>> max_min_partition([1,2,3,4], 2)
     (5, [[1, 4], [2, 3]])
     >>> max_min_partition([1,2,3,4,5], 2)
-    (7, [[3, 5], [1, 2, 4]])
+    (7, [[2, 5], [1, 3, 4]])
     >>> max_min_partition([11,22,33,44,55,66,77,88,99], 3)
-    (165, [[66, 99], [77, 88], [11, 22, 33, 44, 55]])
+    (165, [[22, 44, 99], [11, 66, 88], [33, 55, 77]])
     """
-    (best_state,best_value,best_solution,num_of_states) = PartitionDP(num_of_bins).max_value_solution(items)
+    (best_state,best_value,best_solution,num_of_states) = PartitionDP(num_of_bins, items).max_value_solution(items)
     return (best_value,best_solution)
 
 
@@ -56,12 +98,16 @@ class PartitionDP(SequentialDynamicProgram):
 
     # The states are of the form  (v1, v2, ..., vn) where n is the number of bins.
     # The "vi" is the current sum in bin i.
+    # The states are canonical: v1 <= v2 <= ... <= vn, and the bins in the solution are kept in the same order.
+    # Each state is packed into an int, where vi is stored in field i; the sum of all items determines the field width.
 
-    def __init__(self, num_of_bins:int):
+    def __init__(self, num_of_bins:int, items:List[int]):
         self.num_of_bins = num_of_bins
+        self.field_width = packed_field_width(sum(items))
+        self.remaining_sums = list(accumulate(reversed(items[1:])))[::-1] + [0]   # remaining_sums[i] = sum(items[i+1:])
 
     def initial_states(self):
-        zero_values = self.num_of_bins*(0,)
+        zero_values = 0   # all fields are 0
         return {zero_values}
 
     def initial_solution(self):
@@ -71,19 +117,34 @@ class PartitionDP(SequentialDynamicProgram):
    
     def transition_functions(self):
         return [
-            lambda state, input, bin_index=bin_index: add_input_to_bin_sum(state, bin_index, input)
+            compile_add_input_to_sorted_packed_bin_sum(self.num_of_bins, bin_index, self.field_width)
             for bin_index in range(self.num_of_bins)
         ]
 
+    def batch_transition_function(self):
+        return compile_add_input_to_sorted_packed_bin_sums(self.num_of_bins, self.field_width)
+
     def construction_functions(self):
         return [
-            lambda solution,input,bin_index=bin_index: add_input_to_bin(solution, bin_index, input)
+            lambda solution,input,bin_index=bin_index: sorted(add_input_to_bin(solution, bin_index, input), key=sum)  # a stable sort, so the bins stay in the order of the state.
             for bin_index in range(self.num_of_bins)
         ]
 
 
     def value_function(self):
-        return lambda state: min(state)
+        mask = (1 << self.field_width) - 1
+        return lambda state: state & mask   # the smallest bin sum is in the lowest field.
+
+    def pruning_function(self):
+        # The bin sums only grow, so the smallest bin sum of every state is a lower bound on the optimal value,
+        #    and the smallest bin sum plus the sum of the remaining items is an upper bound on the value reachable from the state.
+        # A state whose upper bound is below the best lower bound cannot lead to an optimal partition.
+        mask = (1 << self.field_width) - 1
+        def prune(states, input_index):
+            remaining_sum = self.remaining_sums[input_index]
+            best_min = max(state & mask for state in states)
+            return {state for state in states if (state & mask) + remaining_sum >= best_min}
+        return prune
 
 
 
@@ -102,5 +163,6 @@ if __name__=="__main__":
 
     dynprog.sequential.logger.setLevel(logging.INFO)
     print(max_min_value(5*[11]+5*[23], 2))
+    print(max_min_value_best_first(5*[11]+5*[23], 2))
     print(max_min_partition(5*[11]+5*[23], 2))
     # Number of states should be around 100.
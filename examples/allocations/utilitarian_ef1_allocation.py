@@ -9,19 +9,25 @@ The input is a valuation-matrix v, where v[i][j] is the value of agent i to item
 The states are of the form (d11, d12, ..., dnn; b11, b12, ..., bnn) where n is the number of agents.
 where dij := vi(Ai)-vi(Aj).
 and   bij is the largest value for i of an item allocated to j.
+Both matrices are kept in flat tuples, row by row, without the diagonal (see common.off_diagonal_index).
 
 Programmer: Erel Segal-Halevi
 Since: 2021-12
 """
 
 import dynprog, math, logging
-from typing import *
+from operator import add, ge
+from functools import lru_cache
 from dynprog.sequential import SequentialDynamicProgram
 
 from common import (
-    add_input_to_agent_value,
     add_input_to_bin,
+    compile_update_bundle_differences,
     items_as_value_vectors,
+    off_diagonal_index,
+    symmetric_agent_permutations,
+    canonical_flat_matrices,
+    remaining_values_by_agent,
 )
 
 logger = logging.getLogger(__name__)
@@ -52,6 +58,10 @@ def utilitarian_ef1_value(valuation_matrix, efx=False):
     505.0
     >>> utilitarian_ef1_value([[98,91,29,50,76,94],[43,67,93,35,49,12],[45,10,62,47,82,60]],efx=True)
     481.0
+    >>> utilitarian_ef1_value([[5,3]])
+    8.0
+    >>> utilitarian_ef1_value([[5,3]],efx=True)
+    8.0
     """
     items = items_as_value_vectors(valuation_matrix)
     return PartitionDP(valuation_matrix, efx).max_value(items)
@@ -65,23 +75,41 @@ class PartitionDP(SequentialDynamicProgram):
     # The states are of the form (d11, d12, ..., dnn; b11, b12, ..., bnn) where n is the number of agents.
     # where dij := vi(Ai)-vi(Aj).
     # and   bij is the largest value for i of an item allocated to j.
+    # The dij and bij are kept in flat tuples (dij is at index common.off_diagonal_index(n,i,j)), so that updating them builds a single tuple.
+    # dii is always 0, and bii is never updated, so the diagonals are not kept.
 
     def __init__(self, valuation_matrix, efx=False):
         num_of_agents = self.num_of_agents = len(valuation_matrix)
-        self.thresholds = [
-            sum(valuation_matrix[i]) / num_of_agents
-            for i in range(num_of_agents)
-        ]
         self.valuation_matrix = valuation_matrix
         self.sum_valuation_matrix = sum(map(sum, valuation_matrix))
         self.efx = efx
+        # For EFx, bij starts at a value that is at least the value of every item, rather than at inf, so that the states hold only ints:
+        #    it is replaced by the first item that j gets, and while j has no item, dij >= 0, so the EFx condition holds anyway.
+        self.largest_item_value = max(
+            (value for agent_values in valuation_matrix for value in agent_values),
+            default=0,
+        )
+        self.symmetric_agent_permutations = symmetric_agent_permutations(
+            valuation_matrix
+        )
+        remaining_values = remaining_values_by_agent(valuation_matrix)
+        # minus_remaining_values[t][off_diagonal_index(n,i,j)] = -(the value for agent i of the items after item t).
+        self.minus_remaining_values = [
+            tuple(
+                -remaining_values[i][t]
+                for i in range(num_of_agents)
+                for j in range(num_of_agents)
+                if i != j
+            )
+            for t in range(len(valuation_matrix[0]))
+        ]
 
     def initial_states(self):
-        zero_differences = self.num_of_agents * (self.num_of_agents * (0,),)
-        # print("zero_differences",zero_differences)
-        initial_value_to_remove = math.inf if self.efx else 0
-        largest_value_owned_by_others = self.num_of_agents * (
-            self.num_of_agents * (initial_value_to_remove,),
+        num_of_differences = self.num_of_agents * (self.num_of_agents - 1)
+        zero_differences = num_of_differences * (0,)
+        initial_value_to_remove = self.largest_item_value if self.efx else 0
+        largest_value_owned_by_others = num_of_differences * (
+            initial_value_to_remove,
         )
         return {(zero_differences, largest_value_owned_by_others)}
 
@@ -91,19 +119,20 @@ class PartitionDP(SequentialDynamicProgram):
 
     def transition_functions(self):
         return [
-            lambda state, input, agent_index=agent_index: (
-                _update_bundle_differences(state[0], agent_index, input),
-                _update_value_owned_by_others(
-                    state[1],
-                    agent_index,
-                    input[-1],
-                    self.valuation_matrix,
-                    self.efx,
-                ),
+            lambda state, input, update_bundle_differences=compile_update_bundle_differences(
+                self.num_of_agents, agent_index
+            ), update_value_owned_by_others=_compile_update_value_owned_by_others(
+                self.num_of_agents, agent_index, self.efx
+            ): (
+                update_bundle_differences(state[0], input),
+                update_value_owned_by_others(state[1], input),
             )
             for agent_index in range(self.num_of_agents)
         ]
 
+    def batch_transition_function(self):
+        return _compile_batch_transition(self.num_of_agents, self.efx)
+
     def construction_functions(self):
         return [
             lambda solution, input, agent_index=agent_index: add_input_to_bin(
@@ -114,93 +143,157 @@ class PartitionDP(SequentialDynamicProgram):
 
     def value_function(self):
         return (
-            lambda state: (sum(map(sum, state[0])) + self.sum_valuation_matrix)
+            lambda state: (sum(state[0]) + self.sum_valuation_matrix)
             / self.num_of_agents
             if self._is_ef1(state[0], state[1])
             else -math.inf
         )
 
+    def pruning_function(self):
+        # Giving the remaining items to agent i raises dij+bij by at most their value to i, and giving them to others cannot raise it.
+        # So a state in which dij+bij, plus the remaining value for i, is negative, cannot lead to an EF1 allocation.
+        # States that differ from a kept state by renaming identical agents are dropped.
+        agent_permutations = self.symmetric_agent_permutations
+
+        def prune(states, input_index):
+            bounds = self.minus_remaining_values[input_index]
+            kept_states = {
+                state
+                for state in states
+                if all(map(ge, map(add, state[0], state[1]), bounds))
+            }
+            if not kept_states:
+                return states  # if no state can become EF1, all are kept, so the value is -inf as before.
+            if agent_permutations:
+                kept_states = set(
+                    {
+                        canonical_flat_matrices(state, agent_permutations): state
+                        for state in kept_states
+                    }.values()
+                )
+            return kept_states
+
+        return prune
+
     def _is_ef1(
         self, bundle_differences: list, largest_value_owned_by_others: list
     ) -> bool:
-        return all(
-            [
-                bundle_differences[i][j] + largest_value_owned_by_others[i][j]
-                >= 0
-                for i in range(self.num_of_agents)
-                for j in range(self.num_of_agents)
-            ]
-        )
-
-
-def _update_bundle_differences(bundle_differences, agent_index, item_values):
-    """
-    >>> _update_bundle_differences( ((0,0),(0,0)), 0, [11,33,0]  )
-    ((0, 11), (-33, 0))
-    >>> _update_bundle_differences( ((0,0),(0,0)), 1, [11,33,0]  )
-    ((0, -11), (33, 0))
-    """
-    # print("bundle_differences",bundle_differences)
-    num_of_agents = len(bundle_differences)
-    new_bundle_differences = [list(d) for d in bundle_differences]
-    for other_agent_index in range(num_of_agents):
-        if other_agent_index == agent_index:
-            continue
-        new_bundle_differences[agent_index][other_agent_index] += item_values[
-            agent_index
-        ]
-        new_bundle_differences[other_agent_index][agent_index] -= item_values[
-            other_agent_index
-        ]
-    new_bundle_differences = tuple((tuple(d) for d in new_bundle_differences))
-    return new_bundle_differences
+        return min(map(add, bundle_differences, largest_value_owned_by_others), default=0) >= 0
 
 
 def _update_value_owned_by_others(
     largest_value_owned_by_others: list,
     agent_index: int,
-    item_index: int,
-    valuation_matrix,
+    item_values: list,
     efx=False,
 ):
     """
-    Update the matrix of largest-value-owned-by-others when
-    the item #item_index is given to the agent #agent_index.
-    >>> _update_value_owned_by_others([[0,0,0],[0,0,0],[0,0,0]], 0, 0, [[55,66,77],[88,99,11],[22,33,44]])
-    ((0, 0, 0), (88, 0, 0), (22, 0, 0))
-    >>> _update_value_owned_by_others([[0,20,30],[40,0,60],[70,80,0]], 0, 0, [[55,66,77],[88,99,11],[22,33,44]])
-    ((0, 20, 30), (88, 0, 60), (70, 80, 0))
+    Update the flat matrix of largest-value-owned-by-others (bij is at index common.off_diagonal_index(n,i,j)) when
+    the item with the given values is given to the agent #agent_index.
+    This is the reference implementation of _compile_update_value_owned_by_others, which is used by the dynamic program.
+    >>> _update_value_owned_by_others((0,0, 0,0, 0,0), 0, [55,88,22,0])
+    (0, 0, 88, 0, 22, 0)
+    >>> _update_value_owned_by_others((20,30, 40,60, 70,80), 0, [55,88,22,0])
+    (20, 30, 88, 60, 70, 80)
     """
-    num_of_agents = len(largest_value_owned_by_others)
-    new_largest_value_owned_by_others = [
-        list(d) for d in largest_value_owned_by_others
-    ]
+    num_of_agents = len(item_values) - 1  # the last value is the item index.
+    replace = min if efx else max
+    new_largest_value_owned_by_others = list(largest_value_owned_by_others)
     for other_agent_index in range(num_of_agents):
         if other_agent_index == agent_index:
             continue
-        other_agent_value = valuation_matrix[other_agent_index][item_index]
-        if efx:
-            replace_item = (
-                other_agent_value
-                < new_largest_value_owned_by_others[other_agent_index][
-                    agent_index
-                ]
-            )
-        else:  # ef1
-            replace_item = (
-                other_agent_value
-                > new_largest_value_owned_by_others[other_agent_index][
-                    agent_index
-                ]
-            )
-        if replace_item:
-            new_largest_value_owned_by_others[other_agent_index][
-                agent_index
-            ] = other_agent_value
-    new_largest_value_owned_by_others = tuple(
-        (tuple(d) for d in new_largest_value_owned_by_others)
+        index = off_diagonal_index(num_of_agents, other_agent_index, agent_index)
+        new_largest_value_owned_by_others[index] = replace(
+            largest_value_owned_by_others[index], item_values[other_agent_index]
+        )
+    return tuple(new_largest_value_owned_by_others)
+
+
+@lru_cache(maxsize=None)
+def _compile_update_value_owned_by_others(
+    num_of_agents: int, agent_index: int, efx=False
+):
+    """
+    Returns a function (largest_value_owned_by_others, item_values) -> new largest_value_owned_by_others,
+    that does the same as _update_value_owned_by_others for a fixed number of agents and a fixed agent index.
+    The function is generated at runtime with the tuple construction unrolled, and with a min/max call instead of a branch per entry.
+    >>> _compile_update_value_owned_by_others(3, 0)( (20,30, 40,60, 70,80), [55,88,22,0] )
+    (20, 30, 88, 60, 70, 80)
+    >>> _compile_update_value_owned_by_others(2, 1, efx=True)( (math.inf, math.inf), [11,22,0] )
+    (11, inf)
+    >>> _compile_update_value_owned_by_others(1, 0)( (), [11,0] )
+    ()
+    >>> all(
+    ...     _compile_update_value_owned_by_others(3, agent_index, efx)( (20,30, 40,60, 70,80), [55,88,22,0] )
+    ...     == _update_value_owned_by_others((20,30, 40,60, 70,80), agent_index, [55,88,22,0], efx)
+    ...     for agent_index in range(3) for efx in (False, True))
+    True
+    """
+    replace = "min" if efx else "max"
+    new_largest_value_owned_by_others = []
+    for i in range(num_of_agents):
+        for j in range(num_of_agents):
+            if i == j:
+                continue
+            index = off_diagonal_index(num_of_agents, i, j)
+            if j == agent_index:
+                new_largest_value_owned_by_others.append(
+                    f"{replace}(largest_value_owned_by_others[{index}], item_values[{i}])"
+                )
+            else:
+                new_largest_value_owned_by_others.append(
+                    f"largest_value_owned_by_others[{index}]"
+                )
+    return eval(
+        "lambda largest_value_owned_by_others, item_values: ("
+        + "".join(f"{x}, " for x in new_largest_value_owned_by_others)
+        + ")"
     )
-    return new_largest_value_owned_by_others
+
+
+@lru_cache(maxsize=None)
+def _compile_batch_transition(num_of_agents: int, efx=False):
+    """
+    Returns a function (state, item_values) -> tuple of new states, whose element #agent_index is
+    the state after giving the item to agent #agent_index, like the transition functions of PartitionDP.
+    The function is generated at runtime for a fixed number of agents:
+    the state and the item values are unpacked only once for all agents, and the new tuples are built unrolled.
+    >>> _compile_batch_transition(2)( ((0, 0), (0, 0)), [11,33,0] )
+    (((11, -33), (0, 33)), ((-11, 33), (11, 0)))
+    >>> _compile_batch_transition(2, efx=True)( ((11, -33), (5, 33)), [11,22,1] )
+    (((22, -55), (5, 22)), ((0, -11), (5, 33)))
+    """
+    replace = "min" if efx else "max"
+    off_diagonal_pairs = [
+        (i, j) for i in range(num_of_agents) for j in range(num_of_agents) if i != j
+    ]  # in the order of off_diagonal_index.
+    differences = "".join(f"d{i}_{j}, " for (i, j) in off_diagonal_pairs)
+    largest_values = "".join(f"b{i}_{j}, " for (i, j) in off_diagonal_pairs)
+    values = "".join(f"x{i}, " for i in range(num_of_agents))
+    lines = [
+        "def batch_transition(state, item_values):",
+        f"    ({differences}), ({largest_values}) = state",
+        f"    {values}= item_values[:{num_of_agents}]",
+    ]
+    new_states = []
+    for agent_index in range(num_of_agents):
+        new_differences = "".join(
+            f"d{i}_{j}+x{i}, "
+            if i == agent_index
+            else f"d{i}_{j}-x{i}, "
+            if j == agent_index
+            else f"d{i}_{j}, "
+            for (i, j) in off_diagonal_pairs
+        )
+        new_largest_values = "".join(
+            f"{replace}(b{i}_{j}, x{i}), " if j == agent_index else f"b{i}_{j}, "
+            for (i, j) in off_diagonal_pairs
+        )
+        new_states.append(f"(({new_differences}), ({new_largest_values}))")
+    lines.append(f"    return ({''.join(new_state + ', ' for new_state in new_states)})")
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace["batch_transition"]
 
 
 if __name__ == "__main__":
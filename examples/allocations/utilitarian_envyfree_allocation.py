@@ -8,6 +8,8 @@ The input is a valuation-matrix v, where v[i][j] is the value of agent i to item
 
 The states are the bundle-differences: (d11, d12, ..., dnn) where n is the number of agents.
 where dij := vi(Ai)-vi(Aj).
+When all values are non-negative integers, the differences are packed into a single int (see common.pack),
+with a bias that makes every field non-negative. Otherwise, they are kept in a flat tuple without the diagonal (see common.off_diagonal_index).
 
 Programmer: Erel Segal-Halevi
 Since: 2021-12
@@ -15,10 +17,12 @@ Since: 2021-12
 
 import dynprog, math, logging
 from dynprog.sequential import SequentialDynamicProgram
+from operator import ge
 
-from common import add_input_to_bin, items_as_value_vectors
-
-from typing import *
+from common import (
+    add_input_to_bin, items_as_value_vectors, compile_update_bundle_differences, pareto_optimal_states,
+    is_non_negative_integer_matrix, remaining_values_by_agent, packed_field_width, pack, unpack, packed_pareto_optimal_states,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -40,9 +44,13 @@ def utilitarian_envyfree_value(valuation_matrix):
     88.0
     >>> utilitarian_envyfree_value([[11],[22]])  # no envy-free allocation
     -inf
+    >>> utilitarian_envyfree_value([[0.4,0.6],[0.6,0.4]])
+    1.2
+    >>> utilitarian_envyfree_value([[-2,-1,5],[-4,8,1]])
+    11.0
     """
-    items = items_as_value_vectors(valuation_matrix)
-    return PartitionDP(valuation_matrix).max_value(items)
+    dp = PartitionDP(valuation_matrix)
+    return dp.max_value(dp.items_as_difference_deltas(valuation_matrix))
 
 
 
@@ -52,14 +60,74 @@ class PartitionDP(SequentialDynamicProgram):
 
     # The states are the bundle-differences: (d11, d12, ..., dnn) where n is the number of agents.
     # where dij := vi(Ai)-vi(Aj).
+    # The dij are packed into an int, where dij+bias is stored in field i*n+j; |dij| < bias, so all fields are non-negative and the guard bits are 0.
+    # Giving an item to an agent changes the packed state by a fixed "delta" (that may be negative), so a transition is a single int addition.
+    # The inputs are items returned by items_as_difference_deltas.
+    # Packing requires non-negative integer values; otherwise, the dij are kept in a flat tuple (at index common.off_diagonal_index(n,i,j)),
+    #    and the inputs are items returned by common.items_as_value_vectors.
 
     def __init__(self, valuation_matrix):
-        self.num_of_agents = len(valuation_matrix)
+        num_of_agents = self.num_of_agents = len(valuation_matrix)
         self.valuation_matrix = valuation_matrix
         self.sum_valuation_matrix =  sum(map(sum,valuation_matrix))
+        self.packed = is_non_negative_integer_matrix(valuation_matrix)
+        if not self.packed:
+            # With negative values, an item given to agent i or to agent j raises dij by at most its absolute value to i.
+            # minus_remaining_values[t][off_diagonal_index(n,i,j)] = -(the absolute value for agent i of the items after item t).
+            remaining_absolute_values = remaining_values_by_agent([[abs(value) for value in agent_values] for agent_values in valuation_matrix])
+            self.minus_remaining_values = [
+                tuple(-remaining_absolute_values[i][t] for i in range(num_of_agents) for j in range(num_of_agents) if i != j)
+                for t in range(len(valuation_matrix[0]))
+            ]
+            return
+        remaining_values = remaining_values_by_agent(valuation_matrix)
+        self.field_width = packed_field_width(max(map(sum, valuation_matrix))) + 1   # the top bit of each field is a guard bit.
+        self.bias = 1 << (self.field_width-2)   # the bit below the guard bit is set iff the difference is non-negative.
+        self.bias_bits = pack(num_of_agents * num_of_agents * [self.bias], self.field_width)
+        self.guard_bits = pack(num_of_agents * num_of_agents * [1 << (self.field_width-1)], self.field_width)
+        # feasibility_thresholds[t] packs, in field i*n+j, the bias minus the value for agent i of the items after item t.
+        self.feasibility_thresholds = [
+            pack([self.bias - remaining_values[i][t] for i in range(num_of_agents) for j in range(num_of_agents)], self.field_width)
+            for t in range(len(valuation_matrix[0]))
+        ]
+
+    def items_as_difference_deltas(self, valuation_matrix):
+        """
+        Converts the valuation matrix into a list of vectors, one per item, like common.items_as_value_vectors.
+        Element i of the vector for an item is the change in the packed state when the item is given to agent i:
+        vi(item) is added to di* and, for each other agent j, vj(item) is subtracted from dji.
+        The last element is the item index.
+        If the states are not packed, the items are returned as common.items_as_value_vectors.
+
+        >>> dp = PartitionDP([[11],[33]])
+        >>> deltas = dp.items_as_difference_deltas([[11],[33]])
+        >>> [dp._differences(dp.initial_states().pop() + delta) for delta in deltas[0][:-1]]
+        [(0, 11, -33, 0), (0, -11, 33, 0)]
+        """
+        if not self.packed:
+            return items_as_value_vectors(valuation_matrix)
+        num_of_agents = self.num_of_agents
+        deltas = []
+        for item_index, item_values in enumerate(zip(*valuation_matrix)):
+            delta_vector = []
+            for agent_index in range(num_of_agents):
+                differences = num_of_agents * num_of_agents * [0]
+                for other_agent_index in range(num_of_agents):
+                    if other_agent_index==agent_index: continue
+                    differences[agent_index*num_of_agents + other_agent_index] += item_values[agent_index]
+                    differences[other_agent_index*num_of_agents + agent_index] -= item_values[other_agent_index]
+                delta_vector.append(sum(difference << (index*self.field_width) for index,difference in enumerate(differences)))
+            deltas.append(tuple(delta_vector) + (item_index,))
+        return deltas
+
+    def _differences(self, state)->tuple:
+        # The flat tuple of differences packed in the given state.
+        return tuple(field - self.bias for field in unpack(state, self.num_of_agents*self.num_of_agents, self.field_width))
 
     def initial_states(self):
-        zero_differences = self.num_of_agents * (self.num_of_agents*(0,),)
+        if not self.packed:
+            return {self.num_of_agents*(self.num_of_agents-1)*(0,)}
+        zero_differences = self.bias_bits   # all differences are 0, so all fields are equal to the bias.
         return {zero_differences}
 
     def initial_solution(self):
@@ -67,8 +135,13 @@ class PartitionDP(SequentialDynamicProgram):
         return empty_bundles
    
     def transition_functions(self):
+        if not self.packed:
+            return [
+                compile_update_bundle_differences(self.num_of_agents, agent_index)
+                for agent_index in range(self.num_of_agents)
+            ]
         return [
-            lambda state, input, agent_index=agent_index: _update_bundle_differences(state, agent_index, input)
+            lambda state, input, agent_index=agent_index: state + input[agent_index]
             for agent_index in range(self.num_of_agents)
         ]
 
@@ -79,29 +152,50 @@ class PartitionDP(SequentialDynamicProgram):
         ]
 
     def value_function(self):
-        return lambda state: (sum(map(sum,state))+self.sum_valuation_matrix) / self.num_of_agents if self._is_envyfree(state) else -math.inf
+        if not self.packed:
+            return lambda state: (sum(state)+self.sum_valuation_matrix) / self.num_of_agents if min(state, default=0) >= 0 else -math.inf
+        return lambda state: (sum(self._differences(state))+self.sum_valuation_matrix) / self.num_of_agents if self._is_envyfree(state) else -math.inf
     
-    def _is_envyfree(self, bundle_differences:list)->bool:
-        return all([bundle_differences[i][j]>=0 for i in range(self.num_of_agents) for j in range(self.num_of_agents)])
-
+    def _is_envyfree(self, state:int)->bool:
+        return state & self.bias_bits == self.bias_bits   # all differences are non-negative.
+
+    def pruning_function(self):
+        # Giving the remaining items to agent i raises dij by at most their value to i, and giving them to others cannot raise it.
+        # So a state in which dij, plus the remaining value for i, is negative, cannot lead to an envy-free allocation.
+        if not self.packed:
+            return self._tuple_pruning_function()
+        # Equivalently, every field must be at least the corresponding field of the feasibility threshold;
+        #    this is checked for all fields at once, like the dominance check in common.packed_pareto_optimal_states.
+        guard_bits = self.guard_bits
+        # If a state is at least as large as another state in every difference, then after giving the remaining items in the same way,
+        #    it is still at least as large, so it is envy-free whenever the other state is, and its value is at least as high.
+        # With 3 or more agents there are 6 or more independent differences, so few states are dominated,
+        #    and the quadratic dominance check costs much more than it saves; so it is used only for 2 agents.
+        prune_dominated_states = self.num_of_agents == 2
+        def prune(states, input_index):
+            threshold = self.feasibility_thresholds[input_index]
+            kept_states = {state for state in states if ((state | guard_bits) - threshold) & guard_bits == guard_bits}
+            if not kept_states:
+                return states   # if no state can become envy-free, all are kept, so the value is -inf as before.
+            if prune_dominated_states:
+                kept_states = packed_pareto_optimal_states(kept_states, self.num_of_agents*self.num_of_agents, self.field_width)
+            return kept_states
+        return prune
+
+    def _tuple_pruning_function(self):
+        # The same pruning as in pruning_function, for states that are not packed.
+        prune_dominated_states = self.num_of_agents == 2
+        def prune(states, input_index):
+            bounds = self.minus_remaining_values[input_index]
+            kept_states = {state for state in states if all(map(ge, state, bounds))}
+            if not kept_states:
+                return states
+            if prune_dominated_states:
+                kept_states = pareto_optimal_states(kept_states)
+            return kept_states
+        return prune
 
 
-def _update_bundle_differences(bundle_differences, agent_index, item_values):
-    """
-    >>> _update_bundle_differences( ((0,0),(0,0)), 0, [11,33,0]  )
-    ((0, 11), (-33, 0))
-    >>> _update_bundle_differences( ((0,0),(0,0)), 1, [11,33,0]  )
-    ((0, -11), (33, 0))
-    """
-    num_of_agents = len(bundle_differences)
-    new_bundle_differences = [list(d) for d in bundle_differences]
-    for other_agent_index in range(num_of_agents):
-        if other_agent_index==agent_index: continue
-        new_bundle_differences[agent_index][other_agent_index] += item_values[agent_index]
-        new_bundle_differences[other_agent_index][agent_index] -= item_values[other_agent_index]
-    new_bundle_differences = tuple((tuple(d) for d in new_bundle_differences))
-    return new_bundle_differences
-
 
 
 
@@ -116,7 +210,7 @@ if __name__=="__main__":
     (failures,tests) = doctest.testmod(report=True)
     print ("{} failures, {} tests".format(failures,tests))
 
-    dynprog.general.logger.setLevel(logging.WARNING)
+    dynprog.sequential.logger.setLevel(logging.WARNING)
     import numpy as np
     valuation_matrix = np.random.randint(0,99, [3,9])
     print("valuation_matrix:\n",valuation_matrix)
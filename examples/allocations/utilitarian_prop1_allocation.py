@@ -19,9 +19,9 @@ import dynprog
 from dynprog.sequential import SequentialDynamicProgram
 
 import math, logging
-from typing import *
-
-from common import add_input_to_agent_value, add_input_to_bin, items_as_value_vectors
+from operator import add, ge
+from functools import lru_cache
+from common import add_input_to_bin, items_as_value_vectors, proportional_thresholds, identical_agent_groups, remaining_values_by_agent, is_canonical_state, canonical_state
 
 logger = logging.getLogger(__name__)
 
@@ -67,7 +67,7 @@ def utilitarian_prop1_allocation(valuation_matrix, propx=False):
     >>> utilitarian_prop1_allocation([[11,0,11,11],[0,11,11,11],[33,33,33,33]])
     (132, [[], [], [0, 1, 2, 3]])
     >>> utilitarian_prop1_allocation([[11,0,11,11],[0,11,11,11],[33,33,33,33]], propx=True)
-    (88, [[3], [2], [0, 1]])
+    (88, [[0], [1], [2, 3]])
     >>> utilitarian_prop1_allocation([[11],[22]]) 
     (22, [[], [0]])
     >>> utilitarian_prop1_allocation([[11],[22]], propx=True)
@@ -95,15 +95,20 @@ class PartitionDP(SequentialDynamicProgram):
 
     def __init__(self, valuation_matrix, propx=False):
         num_of_agents = self.num_of_agents = len(valuation_matrix)
-        self.thresholds = [sum(valuation_matrix[i])/num_of_agents for i in range(num_of_agents)]
+        self.thresholds = proportional_thresholds(valuation_matrix)
         self.valuation_matrix = valuation_matrix
         self.propx = propx
+        self.identical_agent_groups = identical_agent_groups(valuation_matrix)
+        self.remaining_values = list(zip(*remaining_values_by_agent(valuation_matrix)))   # remaining_values[t][i] = the value for agent i of the items after item t.
+        # largest_remaining_sums[t] = the sum, over the items after item t, of the largest value of the item to any agent.
+        largest_item_values = [max(item_values) for item_values in zip(*valuation_matrix)]
+        self.largest_remaining_sums = remaining_values_by_agent([largest_item_values])[0]
 
     def initial_states(self):
         zero_values = self.num_of_agents*(0,)
         initial_value_to_remove = math.inf if self.propx else 0
         largest_value_owned_by_others = self.num_of_agents*(initial_value_to_remove,)
-        yield (zero_values, largest_value_owned_by_others)
+        return {(zero_values, largest_value_owned_by_others)}
 
     def initial_solution(self):
         empty_bundles = [ [] for _ in range(self.num_of_agents)]
@@ -111,51 +116,177 @@ class PartitionDP(SequentialDynamicProgram):
    
     def transition_functions(self):
         return [
-            lambda state, input, agent_index=agent_index: \
-                (add_input_to_agent_value(state[0], agent_index, input) , \
-                _update_value_owned_by_others(state[1], agent_index, input[-1], self.valuation_matrix, self.propx) )
+            _compile_transition(self.num_of_agents, agent_index, self.propx)
             for agent_index in range(self.num_of_agents)
         ]
 
+    def batch_transition_function(self):
+        return _compile_batch_transition(self.num_of_agents, self.propx)
+
     def construction_functions(self):
         return [
             lambda solution,input,agent_index=agent_index: add_input_to_bin(solution, agent_index, input[-1])
             for agent_index in range(self.num_of_agents)
         ]
 
+    def pruning_function(self):
+        # A state in which vi+bi, plus the remaining value for i, is below the threshold of i, cannot become PROP1.
+        # For PROP1 (but not PROPx) a PROP1 state stays PROP1, so no state with a smaller or equal sum can do better than the best PROP1 state.
+        # States that differ from a kept state by renaming identical agents are dropped.
+        # If the greedy allocation is PROP1, a state whose sum plus the largest remaining sum is below its value cannot do better.
+        thresholds = self.thresholds
+        prune_by_best_prop1_state = not self.propx
+        agent_groups = self.identical_agent_groups
+        greedy_value = self.greedy_value()
+        def prune(states, input_index):
+            remaining_value = self.remaining_values[input_index]
+            largest_remaining_sum = self.largest_remaining_sums[input_index]
+            kept_states = {
+                state for state in states
+                if all(map(ge, map(add, map(add, state[0], state[1]), remaining_value), thresholds))
+            }
+            if not kept_states:
+                return states   # if no state can become PROP1, all are kept, so the value is -inf as before.
+            if greedy_value > -math.inf:
+                smallest_sum = greedy_value - largest_remaining_sum
+                kept_states = {state for state in kept_states if sum(state[0]) >= smallest_sum}   # the states along the greedy allocation are kept.
+            if prune_by_best_prop1_state:
+                prop1_states = [state for state in kept_states if self._is_prop1(state[0], state[1])]
+                if prop1_states:
+                    best_prop1_state = max(prop1_states, key=lambda state: sum(state[0]))
+                    best_prop1_sum = sum(best_prop1_state[0])
+                    kept_states = {state for state in kept_states if sum(state[0]) > best_prop1_sum}
+                    kept_states.add(best_prop1_state)
+            if agent_groups:
+                kept_states = {
+                    state for state in kept_states
+                    if is_canonical_state(state, agent_groups) or canonical_state(state, agent_groups) not in kept_states
+                }
+            return kept_states
+        return prune
+
+    def greedy_value(self):
+        """
+        Returns the value of the allocation that gives each item to an agent who values it most, if it is PROP1 (or PROPx), otherwise -inf.
+        This allocation has the largest sum of values of all allocations, so when it is PROP1 it is optimal.
+
+        >>> PartitionDP([[11,0,11],[33,44,55]]).greedy_value()
+        132
+        >>> PartitionDP([[11,0,11],[33,44,55]], propx=True).greedy_value()
+        -inf
+        """
+        state = next(iter(self.initial_states()))
+        transition_functions = self.transition_functions()
+        for item_values in items_as_value_vectors(self.valuation_matrix):
+            agent_index = max(range(self.num_of_agents), key=item_values.__getitem__)
+            state = transition_functions[agent_index](state, item_values)
+        return self.value_function()(state)
+
     def value_function(self):
         return lambda state: sum(state[0]) if self._is_prop1(state[0], state[1]) else -math.inf
     
     def _is_prop1(self, bundle_values:list,largest_value_owned_by_others:list)->bool:
-        return all([bundle_values[i] + largest_value_owned_by_others[i] >= self.thresholds[i] for i in range(self.num_of_agents)])
+        return all(map(ge, map(add, bundle_values, largest_value_owned_by_others), self.thresholds))
 
 
 
 
 
-def _update_value_owned_by_others(largest_value_owned_by_others:list, agent_index:int, item_index:int, valuation_matrix, propx=False):
+def _update_value_owned_by_others(largest_value_owned_by_others:list, agent_index:int, item_values:list, propx=False):
     """
-    :param input: a list of values: input[i] represents the value of the current item for agent i.
+    :param item_values: a list of values: item_values[i] represents the value of the current item for agent i.
+       These are read from the input vector, rather than from the valuation matrix, to save a nested lookup per agent.
 
     Adds the given item to agent #agent_index.
-    >>> _update_value_owned_by_others([33, 44, 66], 0, 0, [[55,66,77],[88,99,11],[22,33,44]])
+    This is the reference implementation of the second part of _compile_transition, which is used by the dynamic program.
+    >>> _update_value_owned_by_others((33, 44, 66), 0, [55,88,22,0])
     (33, 88, 66)
+    >>> _update_value_owned_by_others((33, 99, 66), 0, [55,88,22,0])
+    (33, 99, 66)
     """
-    logger.info(largest_value_owned_by_others)
-    new_largest_value_owned_by_others = list(largest_value_owned_by_others)
+    new_largest_value_owned_by_others = None   # copied on the first change, so an unchanged tuple is shared between states.
     num_of_agents = len(largest_value_owned_by_others)
     for other_agent_index in range(num_of_agents):
         if other_agent_index!=agent_index:
-            other_agent_value = valuation_matrix[other_agent_index][item_index]
+            other_agent_value = item_values[other_agent_index]
             if propx:
-                should_replace_item = other_agent_value < new_largest_value_owned_by_others[other_agent_index]
+                should_replace_item = other_agent_value < largest_value_owned_by_others[other_agent_index]
             else: # prop1
-                should_replace_item = other_agent_value > new_largest_value_owned_by_others[other_agent_index]
+                should_replace_item = other_agent_value > largest_value_owned_by_others[other_agent_index]
             if should_replace_item:
+                if new_largest_value_owned_by_others is None:
+                    new_largest_value_owned_by_others = list(largest_value_owned_by_others)
                 new_largest_value_owned_by_others[other_agent_index] = other_agent_value
+    if new_largest_value_owned_by_others is None:
+        return largest_value_owned_by_others
     return tuple(new_largest_value_owned_by_others)
 
 
+@lru_cache(maxsize=None)
+def _compile_transition(num_of_agents:int, agent_index:int, propx=False):
+    """
+    Returns a function (state, item_values) -> new state, that gives the item to agent #agent_index:
+    it adds the item value to the bundle value of the agent (like common.add_input_to_agent_value),
+    and updates the largest values owned by others (like _update_value_owned_by_others).
+    The function is generated at runtime for a fixed number of agents and a fixed agent index:
+    the state is unpacked once, both tuples are built unrolled, and there is a min/max call instead of a branch per agent.
+    >>> _compile_transition(3, 0)( ((11, 22, 33), (33, 44, 66)), [55,88,22,0] )
+    ((66, 22, 33), (33, 88, 66))
+    >>> _compile_transition(2, 1, propx=True)( ((0, 0), (math.inf, math.inf)), [11,22,0] )
+    ((0, 22), (11, inf))
+    >>> all(
+    ...     _compile_transition(3, agent_index, propx)( ((11, 22, 33), (33, 99, 66)), [55,88,22,0] )[1]
+    ...     == _update_value_owned_by_others((33, 99, 66), agent_index, [55,88,22,0], propx)
+    ...     for agent_index in range(3) for propx in (False, True))
+    True
+    """
+    replace = "min" if propx else "max"
+    bundle_values = [f"v{i}" for i in range(num_of_agents)]
+    largest_value_owned_by_others = [f"b{i}" for i in range(num_of_agents)]
+    new_bundle_values = [
+        f"v{i}+item_values[{i}]" if i==agent_index else f"v{i}"
+        for i in range(num_of_agents)
+    ]
+    new_largest_value_owned_by_others = [
+        f"b{i}" if i==agent_index else f"{replace}(b{i}, item_values[{i}])"
+        for i in range(num_of_agents)
+    ]
+    lines = [
+        "def transition(state, item_values):",
+        f"    ({', '.join(bundle_values)},), ({', '.join(largest_value_owned_by_others)},) = state",
+        f"    return (({', '.join(new_bundle_values)},), ({', '.join(new_largest_value_owned_by_others)},))",
+    ]
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace["transition"]
+
+@lru_cache(maxsize=None)
+def _compile_batch_transition(num_of_agents:int, propx=False):
+    """
+    Returns a function (state, item_values) -> tuple of new states, whose element #agent_index is
+    the same as _compile_transition(num_of_agents, agent_index, propx)(state, item_values).
+    The state is unpacked, and each new largest value is computed, only once for all agents.
+    >>> _compile_batch_transition(2)( ((11, 22), (33, 44)), [55,88,0] )
+    (((66, 22), (33, 88)), ((11, 110), (55, 44)))
+    """
+    replace = "min" if propx else "max"
+    lines = [
+        "def batch_transition(state, item_values):",
+        f"    ({''.join(f'v{i}, ' for i in range(num_of_agents))}), ({''.join(f'b{i}, ' for i in range(num_of_agents))}) = state",
+    ]
+    for i in range(num_of_agents):
+        lines.append(f"    new_b{i} = {replace}(b{i}, item_values[{i}])")
+    new_states = []
+    for agent_index in range(num_of_agents):
+        new_bundle_values = "".join(f"v{i}+item_values[{i}], " if i==agent_index else f"v{i}, " for i in range(num_of_agents))
+        new_largest_value_owned_by_others = "".join(f"b{i}, " if i==agent_index else f"new_b{i}, " for i in range(num_of_agents))
+        new_states.append(f"(({new_bundle_values}), ({new_largest_value_owned_by_others}))")
+    lines.append(f"    return ({''.join(new_state + ', ' for new_state in new_states)})")
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace["batch_transition"]
+
+
 
 
 
@@ -17,9 +17,8 @@ import dynprog
 from dynprog.sequential import SequentialDynamicProgram
 
 import math, logging
-from typing import *
-
-from common import add_input_to_agent_value, add_input_to_bin, items_as_value_vectors
+from operator import add, ge
+from common import compile_add_input_to_agent_value, add_input_to_bin, items_as_value_vectors, proportional_thresholds, identical_agent_groups, remaining_values_by_agent, is_canonical_state, canonical_state, pareto_optimal_states
 
 logger = logging.getLogger(__name__)
 
@@ -78,7 +77,9 @@ class PartitionDP(SequentialDynamicProgram):
 
     def __init__(self, valuation_matrix):
         num_of_agents = self.num_of_agents = len(valuation_matrix)
-        self.thresholds = [sum(valuation_matrix[i])/num_of_agents for i in range(num_of_agents)]
+        self.thresholds = proportional_thresholds(valuation_matrix)
+        self.identical_agent_groups = identical_agent_groups(valuation_matrix)
+        self.remaining_values = list(zip(*remaining_values_by_agent(valuation_matrix)))   # remaining_values[t][i] = the value for agent i of the items after item t.
 
     def initial_states(self):
         zero_values = self.num_of_agents*(0,)
@@ -90,7 +91,7 @@ class PartitionDP(SequentialDynamicProgram):
    
     def transition_functions(self):
         return [
-            lambda state, input, agent_index=agent_index: add_input_to_agent_value(state, agent_index, input)
+            compile_add_input_to_agent_value(self.num_of_agents, agent_index)
             for agent_index in range(self.num_of_agents)
         ]
 
@@ -100,12 +101,37 @@ class PartitionDP(SequentialDynamicProgram):
             for agent_index in range(self.num_of_agents)
         ]
 
+    def pruning_function(self):
+        # A state in which vi, plus the remaining value for i, is below the threshold of i, cannot become proportional.
+        # A proportional state stays proportional, so no state with a smaller or equal sum can do better than the best proportional state.
+        # Dominated states, and states that differ from a kept state by renaming identical agents, are dropped.
+        thresholds = self.thresholds
+        agent_groups = self.identical_agent_groups
+        def prune(states, input_index):
+            remaining_value = self.remaining_values[input_index]
+            kept_states = {state for state in states if all(map(ge, map(add, state, remaining_value), thresholds))}
+            if not kept_states:
+                return states   # if no state can become proportional, all are kept, so the value is -inf as before.
+            proportional_states = [state for state in kept_states if self._is_proportional(state)]
+            if proportional_states:
+                best_proportional_state = max(proportional_states, key=sum)
+                best_proportional_sum = sum(best_proportional_state)
+                kept_states = {state for state in kept_states if sum(state) > best_proportional_sum}
+                kept_states.add(best_proportional_state)
+            kept_states = pareto_optimal_states(kept_states)
+            if agent_groups:
+                kept_states = {
+                    state for state in kept_states
+                    if is_canonical_state((state,), agent_groups) or canonical_state((state,), agent_groups)[0] not in kept_states
+                }
+            return kept_states
+        return prune
+
     def value_function(self):
         return lambda state: sum(state) if self._is_proportional(state) else -math.inf
     
     def _is_proportional(self, bundle_values:list)->bool:
-        return all([bundle_values[i] >= self.thresholds[i] for i in range(self.num_of_agents)])
-
+        return all(map(ge, bundle_values, self.thresholds))
 
 
 
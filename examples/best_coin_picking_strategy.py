@@ -17,7 +17,10 @@ Since: 2021-11
 """
 
 import dynprog.sequential_func
-from typing import *
+import functools
+from itertools import accumulate
+from operator import sub
+from typing import List, Tuple
 from numbers import Number
 
 
@@ -71,6 +74,76 @@ def max_value(coins: List[Number], first: bool):
     return value if first else -value
 
 
+def max_value_memoized(coins: List[Number], first: bool):
+    """
+    Returns the same value as max_value, using a recursive function
+    memoized with functools.lru_cache, instead of the generic dynamic program.
+    Each triple (i,j,my_turn) is evaluated exactly once,
+    and no (state,value) tuple is generated per edge.
+
+    >>> max_value_memoized([1,2,3,4], True)
+    6
+    >>> max_value_memoized([6,5,4,3,2], True)
+    12
+    >>> max_value_memoized([1,2,3,4], False)
+    4
+    >>> max_value_memoized([6,5,4,3,2], False)
+    8
+    """
+
+    @functools.lru_cache(maxsize=None)
+    def value(i: int, j: int, my_turn: bool):  # what I win from coins i..j-1
+        if i == j:
+            return 0
+        if my_turn:
+            return max(
+                coins[i] + value(i + 1, j, False),
+                coins[j - 1] + value(i, j - 1, False),
+            )
+        else:
+            return min(value(i + 1, j, True), value(i, j - 1, True))
+
+    return value(0, len(coins), first)
+
+
+def max_value_tabulated(coins: List[Number], first: bool):
+    """
+    Returns the same value as max_value, by filling a table bottom-up,
+    from the shortest rows of coins to the longest.
+    The player to move wins the sum of the row minus what the other player
+    wins from the row that remains, so the turn need not be kept in the table.
+    Only the values of the previous length are kept, and there is no recursion,
+    so it works for long rows too.
+
+    >>> max_value_tabulated([1,2,3,4], True)
+    6
+    >>> max_value_tabulated([6,5,4,3,2], True)
+    12
+    >>> max_value_tabulated([1,2,3,4], False)
+    4
+    >>> max_value_tabulated([6,5,4,3,2], False)
+    8
+    >>> max_value_tabulated([], True)
+    0
+    """
+    num_coins = len(coins)
+    prefix_sums = list(accumulate(coins, initial=0))
+    # values[i] = what the player to move wins from the coins i..i+length-1.
+    values = [0] * (num_coins + 1)
+    # Each length is computed with element-wise maps over shifted lists,
+    # so the loop over i runs in C; map stops at the shortest list.
+    for length in range(1, num_coins + 1):
+        values = list(
+            map(
+                sub,
+                map(sub, prefix_sums[length:], prefix_sums),
+                map(min, values[1:], values),
+            )
+        )
+    value_of_first = values[0]
+    return value_of_first if first else prefix_sums[-1] - value_of_first
+
+
 if __name__ == "__main__":
     import doctest, logging
 
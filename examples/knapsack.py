@@ -9,10 +9,10 @@ Programmer: Erel Segal-Halevi
 Since: 2021-12
 """
 
-import dynprog
+import dynprog, math
 from dynprog.sequential import SequentialDynamicProgram
 
-from typing import *
+from typing import List
 
 
 
@@ -92,9 +92,24 @@ class KnapsackDP(SequentialDynamicProgram):
     def filter_functions(self):
         return [
             lambda state,input: state[0]+input[0]<=self.capacity,    # adding the input: (weight,value)
-            lambda _,__:        True,                                # not adding the input
+            None,                                                    # not adding the input - no filter
         ]
 
+    def pruning_function(self):
+        # A state (weight,value) is dominated by a state with at most the same weight and at least the same value:
+        #    any items that can be added to the former can be added to the latter, with a value at least as high.
+        # After sorting by increasing weight (and decreasing value among equal weights),
+        #    the non-dominated states are those whose value is larger than that of all states before them.
+        def prune(states, input_index):
+            kept_states = set()
+            best_value = -math.inf
+            for state in sorted(states, key=lambda state: (state[0], -state[1])):
+                if state[1] > best_value:
+                    kept_states.add(state)
+                    best_value = state[1]
+            return kept_states
+        return prune
+
 
 
 
@@ -13,7 +13,8 @@ Since: 2021-11
 """
 
 import dynprog.sequential_func
-from typing import *
+import functools
+from typing import Tuple
 
 
 def LPS_length(string: str):
@@ -62,6 +63,37 @@ def LPS_length(string: str):
     )
 
 
+def LPS_length_memoized(string: str):
+    """
+    Returns the same length as LPS_length, using a recursive function
+    memoized with functools.lru_cache, instead of the generic dynamic program.
+    Each pair (i,j) is evaluated at most once,
+    and no (state,value) tuple is generated per edge.
+    The recursion depth grows with len(string), so with the default recursion limit it is meant for strings of up to about 500 letters.
+
+    >>> LPS_length_memoized("a")
+    1
+    >>> LPS_length_memoized("bb")
+    2
+    >>> LPS_length_memoized("abcdba")
+    5
+    >>> LPS_length_memoized("programming")
+    4
+    >>> LPS_length_memoized("")
+    0
+    """
+
+    @functools.lru_cache(maxsize=None)
+    def length(i: int, j: int):  # the LPS length in string[i:j]
+        if j - i <= 1:
+            return j - i
+        if string[i] == string[j - 1]:
+            return length(i + 1, j - 1) + 2
+        return max(length(i + 1, j), length(i, j - 1))
+
+    return length(0, len(string))
+
+
 def LPS_string(string: str, count_states=False):
     """
     Finds the longest palyndromic subsequence in the given string.
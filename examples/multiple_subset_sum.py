@@ -5,6 +5,7 @@ https://en.wikipedia.org/wiki/Multiple_subset_sum
 
 The states are of the form  (v1, v2, ..., vn) where n is the number of bins.
 The "vi" is the current sum in bin i.
+Each state is packed into a single int, together with the total of the bin sums.
 
 Programmer: Erel Segal-Halevi
 Since: 2021-12
@@ -13,7 +14,8 @@ Since: 2021-12
 import dynprog
 from dynprog.sequential import SequentialDynamicProgram
 
-from typing import *
+from typing import List
+from itertools import accumulate
 
 
 
@@ -34,7 +36,7 @@ def max_sum(inputs: List[int], capacities:List[int])->int:
     >>> max_sum([100,200,400,700,1100,1600,2200,2900,3700], [2005,2006])
     4000
     """
-    return MultipleSubsetSumDP(capacities).max_value(inputs)
+    return MultipleSubsetSumDP(capacities, inputs).max_value(inputs)
 
 
 def max_sum_solution(inputs: List[int], capacities:List[int])->int:
@@ -44,7 +46,7 @@ def max_sum_solution(inputs: List[int], capacities:List[int])->int:
     >>> max_sum_solution([3,5], [2,2])
     [[], []]
     >>> max_sum_solution([3,5], [4,4])
-    [[], [3]]
+    [[3], []]
     >>> max_sum_solution([3,5], [6,6])
     [[5], [3]]
     >>> max_sum_solution([3,5], [8,8])
@@ -52,7 +54,7 @@ def max_sum_solution(inputs: List[int], capacities:List[int])->int:
     >>> max_sum_solution([100,200,400,700,1100,1600,2200,2900,3700], [2005,2006])
     [[400, 1600], [200, 700, 1100]]
     """
-    (best_state,best_value,best_solution,num_of_states) =  MultipleSubsetSumDP(capacities).max_value_solution(inputs)
+    (best_state,best_value,best_solution,num_of_states) =  MultipleSubsetSumDP(capacities, inputs).max_value_solution(inputs)
     return best_solution
 
 
@@ -63,13 +65,19 @@ class MultipleSubsetSumDP(SequentialDynamicProgram):
 
     # The states are of the form  (v1, v2, ..., vn) where n is the number of bins.
     # The "vi" is the current sum in bin i.
+    # Each state is packed into an int, where vi is stored in field i, and the total v1+...+vn is stored above the last field,
+    #    so a transition is a single int addition, and the states with the largest total are the largest ints.
+    # The inputs are non-negative integers; their sum determines the field width.
 
-    def __init__(self, capacities:List[int]):
+    def __init__(self, capacities:List[int], inputs:List[int]):
         self.capacities = capacities
         self.num_of_bins = len(capacities)
+        self.field_width = sum(inputs).bit_length()
+        self.total_shift = self.num_of_bins * self.field_width
+        self.remaining_sums = list(accumulate(reversed(inputs[1:])))[::-1] + [0]   # remaining_sums[i] = sum(inputs[i+1:])
 
     def initial_states(self):
-        zero_values = self.num_of_bins*(0,)
+        zero_values = 0   # all fields are 0
         return {zero_values}
 
     def initial_solution(self):
@@ -78,10 +86,11 @@ class MultipleSubsetSumDP(SequentialDynamicProgram):
 
    
     def transition_functions(self):
+        # Adding the input to bin i adds it to field i and to the total, which is the same as adding input*multiplier.
         return [
             lambda state, input: state    # do not add the input at all
         ] + [
-            lambda state, input, bin_index=bin_index: _add_input_to_bin_sum(state, bin_index, input)
+            lambda state,input,multiplier=(1 << (bin_index*self.field_width)) + (1 << self.total_shift): state + input*multiplier
             for bin_index in range(self.num_of_bins)
         ]
 
@@ -94,43 +103,43 @@ class MultipleSubsetSumDP(SequentialDynamicProgram):
         ]
 
     def value_function(self):
-        return lambda state: sum(state)
+        total_shift = self.total_shift
+        return lambda state: state >> total_shift
 
     def filter_functions(self):
+        mask = (1 << self.field_width) - 1
         return  [
-            lambda state,input: True    # do not add the input at all
+            None    # do not add the input at all - no filter
         ] +  [
-            lambda state,input,bin_index=bin_index: state[bin_index]+input <= self.capacities[bin_index]
-            for bin_index in range(self.num_of_bins)
+            lambda state,input,shift=bin_index*self.field_width,capacity=capacity: ((state >> shift) & mask) + input <= capacity
+            for bin_index,capacity in enumerate(self.capacities)
         ]
 
+    def pruning_function(self):
+        # The bin sums only grow, so the total of every state is a lower bound on the optimal value.
+        # The total of a state can grow by at most the sum of the remaining inputs, and by at most the free capacity in its bins;
+        #    a state whose upper bound is below the best lower bound cannot lead to an optimal solution.
+        # (No state is dominated by another in the Pareto sense: at most the same sum in every bin means at most the same total.)
+        total_capacity = sum(self.capacities)
+        total_shift = self.total_shift
+        def prune(states, input_index):
+            remaining_sum = self.remaining_sums[input_index]
+            best_total = max(states) >> total_shift
+            return {state for state in states if (state >> total_shift) + min(remaining_sum, total_capacity-(state >> total_shift)) >= best_total}
+        return prune
 
 
 
-def _add_input_to_bin_sum(bin_sums:list, bin_index:int, input:int):
-    """
-    Adds the given input integer to bin #bin_index in the given list of bins.
-    >>> _add_input_to_bin_sum([11, 22, 33], 0, 77)
-    (88, 22, 33)
-    >>> _add_input_to_bin_sum([11, 22, 33], 1, 77)
-    (11, 99, 33)
-    >>> _add_input_to_bin_sum([11, 22, 33], 2, 77)
-    (11, 22, 110)
-    """
-    new_bin_sums = list(bin_sums)
-    new_bin_sums[bin_index] = new_bin_sums[bin_index] + input
-    return tuple(new_bin_sums)
-
 
 def _add_input_to_bin(bins:list, bin_index:int, input:int):
     """
     Adds the given input integer to bin #bin_index in the given list of bins.
+    The bins are modified in place, since the solution is built only once, along the optimal path.
     >>> _add_input_to_bin([[11,22], [33,44], [55,66]], 1, 77)
     [[11, 22], [33, 44, 77], [55, 66]]
     """
-    new_bins = list(bins)
-    new_bins[bin_index] = new_bins[bin_index]+[input]
-    return new_bins
+    bins[bin_index].append(input)
+    return bins
 
 
 
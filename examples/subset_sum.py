@@ -11,7 +11,8 @@ Since: 2021-12
 import dynprog
 from dynprog.sequential import SequentialDynamicProgram
 
-from typing import *
+from typing import List
+from bisect import bisect_right
 
 
 
@@ -33,6 +34,64 @@ def max_value(inputs: List[int], capacity:int)->int:
     return SubsetSumDP(capacity).max_value(inputs)
 
 
+def max_value_bitset(inputs: List[int], capacity:int)->int:
+    """
+    Returns the same value as max_value, for non-negative integer inputs.
+    The set of reachable sums is kept as the bits of a single int (bit s is 1 iff the sum s is reachable),
+    so adding an input to all sums at once is a single shift and or, done in C over the whole set.
+
+    >>> max_value_bitset([3,5], 2)
+    0
+    >>> max_value_bitset([3,5], 4)
+    3
+    >>> max_value_bitset([3,5], 6)
+    5
+    >>> max_value_bitset([3,5], 8)
+    8
+    >>> max_value_bitset([100,200,400,700,1100,1600,2200,2900,3700], 4005)
+    4000
+    """
+    reachable_sums_mask = (1 << (capacity+1)) - 1   # the sums 0, ..., capacity.
+    reachable_sums = 1   # only the sum 0 is reachable.
+    for input in inputs:
+        reachable_sums |= (reachable_sums << input) & reachable_sums_mask
+    return reachable_sums.bit_length() - 1
+
+
+def max_value_meet_in_the_middle(inputs: List[int], capacity:int)->int:
+    """
+    Returns the same value as max_value, by a meet-in-the-middle search:
+    all subset sums of each half of the inputs are listed, and every sum of the second half
+    is matched with the largest sum of the first half that fits with it, by binary search.
+    This takes time O(2^(n/2) * n) regardless of the capacity,
+    so it is useful when there are a few dozen large inputs, and the number of reachable sums is about 2^n.
+
+    >>> max_value_meet_in_the_middle([3,5], 2)
+    0
+    >>> max_value_meet_in_the_middle([3,5], 4)
+    3
+    >>> max_value_meet_in_the_middle([3,5], 6)
+    5
+    >>> max_value_meet_in_the_middle([3,5], 8)
+    8
+    >>> max_value_meet_in_the_middle([100,200,400,700,1100,1600,2200,2900,3700], 4005)
+    4000
+    """
+    def subset_sums(half):
+        sums = [0]
+        for input in half:
+            sums += [sum+input for sum in sums]
+        return sums
+    middle = len(inputs)//2
+    first_half_sums = sorted(subset_sums(inputs[:middle]))
+    best_sum = 0   # the empty subset.
+    for second_half_sum in subset_sums(inputs[middle:]):
+        index = bisect_right(first_half_sums, capacity - second_half_sum)
+        if index > 0:
+            best_sum = max(best_sum, first_half_sums[index-1] + second_half_sum)
+    return best_sum
+
+
 def max_value_solution(inputs: List[int], capacity:int)->int:
     """
     Returns the maximum sum of values from the given `inputs` list, that can fit within a bin of the given 'capacity'.
@@ -51,6 +110,40 @@ def max_value_solution(inputs: List[int], capacity:int)->int:
     return SubsetSumDP(capacity).max_value_solution(inputs)[2]
 
 
+def max_value_solution_bitset(inputs: List[int], capacity:int)->List[int]:
+    """
+    Returns a subset with the maximum sum, like max_value_solution, for non-negative integer inputs.
+    The reachable sums are computed as in max_value_bitset, keeping the set before each input.
+    The subset is then reconstructed backwards: an input is taken iff the current sum was not reachable before it.
+    When there are several optimal subsets, the one returned may differ from the one returned by max_value_solution.
+
+    >>> max_value_solution_bitset([3,5], 2)
+    []
+    >>> max_value_solution_bitset([3,5], 4)
+    [3]
+    >>> max_value_solution_bitset([3,5], 6)
+    [5]
+    >>> max_value_solution_bitset([3,5], 8)
+    [3, 5]
+    >>> max_value_solution_bitset([100,200,400,700,1100,1600,2200,2900,3700], 4005)
+    [200, 400, 700, 1100, 1600]
+    """
+    reachable_sums_mask = (1 << (capacity+1)) - 1
+    reachable_sums = 1
+    reachable_sums_before_input = []
+    for input in inputs:
+        reachable_sums_before_input.append(reachable_sums)
+        reachable_sums |= (reachable_sums << input) & reachable_sums_mask
+    current_sum = reachable_sums.bit_length() - 1
+    solution = []
+    for input, reachable_sums in zip(reversed(inputs), reversed(reachable_sums_before_input)):
+        if not (reachable_sums >> current_sum) & 1:
+            solution.append(input)
+            current_sum -= input
+    solution.reverse()
+    return solution
+
+
 
 
 
@@ -87,7 +180,7 @@ class SubsetSumDP(SequentialDynamicProgram):
     def filter_functions(self):
         return [
             lambda state,input: state+input<=self.capacity,    # adding the input
-            lambda _,__:        True,                     # not adding the input
+            None,                                          # not adding the input - no filter
         ]
 
 